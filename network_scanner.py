@@ -4,14 +4,23 @@
 # 作者：Austin Huang
 
 import sys
+import array
+import asyncio
 import ipaddress
 import subprocess
 import socket
+import selectors
+import errno
+import struct
+import shutil
 import re
 import csv
 import time
 from datetime import datetime
+from collections import Counter
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import product
+from functools import lru_cache
 import argparse
 import logging
 from rich import print
@@ -29,13 +38,82 @@ from rich.progress import (
     SpinnerColumn,
 )
 from rich.box import HEAVY_EDGE
-from jinja2 import Environment, FileSystemLoader, select_autoescape
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
+from markupsafe import Markup, escape
+import json
 import ssl
 import os
 
+try:
+    import uvloop  # 選用套件：安裝後可加快事件迴圈
+except ImportError:
+    uvloop = None
+
+try:
+    import resource  # 僅 Unix 提供：讀取可開啟的檔案描述元上限
+except ImportError:
+    resource = None
+
+try:
+    import orjson  # 選用套件：安裝後可加快 HTML 報告內嵌資料的序列化
+except ImportError:
+    orjson = None
+
 console = Console()
 
 REPORTS_DIR = "reports"  # 統一將輸出檔案都放在此資料夾底下
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")  # HTML 報告模板所在資料夾
+REPORT_TEMPLATE = "report.html.j2"
+# 模板編譯後的位元組碼快取資料夾（跨次執行共用，省去每次啟動重新編譯）
+TEMPLATE_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "network-scanner",
+)
+
+DISCOVERY_PORTS = (80, 443, 22)  # TCP 存活探測使用的埠
+DISCOVERY_TIMEOUT = 0.5          # 單一 TCP 存活探測的逾時秒數
+DISCOVERY_CONCURRENCY = 512      # 同時進行的 TCP 存活探測上限
+PORT_SCAN_TIMEOUT = 1.0          # 單一埠連線的逾時秒數
+PORT_SCAN_CONCURRENCY = 1000     # 同時進行的埠連線上限
+PER_HOST_CONCURRENCY = 256       # 單一主機同時進行的埠連線上限
+FD_RESERVE = 64                  # 保留給日誌、報告、ARP 子行程等非探測用途的檔案描述元數
+SYNC_BATCH_SIZE = 500            # --sync 模式每批同時送出的非阻塞連線數
+FILTERED_PORT_LIMIT = 50         # 單一主機連續逾時達此埠數即視為被防火牆過濾，略過其餘的埠
+DETECT_TIMEOUT = 2.0             # 服務偵測讀取回應的逾時秒數
+BANNER_LIMIT = 4096              # 服務偵測最多讀取的位元組數（HTTP 需讀完整個標頭，常超過 1 KiB）
+ARP_CACHE_TTL = 15 * 60          # MAC 位址快取的有效秒數
+ARP_REFRESH_INTERVAL = 2.0       # 管線掃描期間兩次讀取 ARP 表的最短間隔秒數
+PROGRESS_REFRESH_RATE = 4        # 進度條每秒最多重繪次數
+PROGRESS_BATCH = 64              # 每累積多少筆完成才更新一次進度條
+CHART_TOP_N = 10                 # 圓餅圖最多顯示的服務數，其餘合併為「其他」
+STATIC_TABLE_LIMIT = 50          # HTML 報告表格列數不超過此值時輸出靜態表格，不初始化 Simple-DataTables
+
+_MAC_CACHE = {}  # MAC 位址快取：{ip: (mac, 到期時間)}
+
+# ARP 表解析用的正規表示式與指令，於載入模組時決定一次即可
+_MAC_RE = re.compile(r"([0-9a-fA-F]{1,2}(?:[:\-][0-9a-fA-F]{1,2}){5})")
+_IPV4_RE = re.compile(r"(\d{1,3}(?:\.\d{1,3}){3})")
+_ARP_ARGS = ["arp", "-a"] if sys.platform.startswith("win") else ["arp", "-an"]
+
+def create_bytecode_cache(directory=TEMPLATE_CACHE_DIR):
+    """建立模板位元組碼快取；資料夾無法建立時（例如權限不足）回傳 None，改為每次重新編譯"""
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        return None
+    return FileSystemBytecodeCache(directory)
+
+# HTML 報告模板環境：模板編譯一次後即保留在環境快取中，不再重新解析
+# trim_blocks / lstrip_blocks 會去掉區塊標籤留下的縮排與換行，減少輸出的空白
+_JINJA = Environment(
+    loader=FileSystemLoader(TEMPLATES_DIR),
+    autoescape=select_autoescape(['html', 'xml', 'html.j2']),
+    cache_size=400,
+    auto_reload=False,
+    trim_blocks=True,
+    lstrip_blocks=True,
+    bytecode_cache=create_bytecode_cache(),
+)
 
 #----------------------------------------------------------------------
 #  1. 產生各種輸出檔名與資料夾路徑
@@ -73,18 +151,54 @@ logging.basicConfig(
 #----------------------------------------------------------------------
 #  3. 服務偵測器 (Detectors)
 #----------------------------------------------------------------------
+def peer_address(writer):
+    """取得連線對端的 (IP, 埠)；連線已被對端重置而取不到時回傳 ("?", None)，讓偵測器照常走自己的備援結果"""
+    peername = writer.get_extra_info("peername")
+    if not peername:
+        return "?", None
+    return peername[0], peername[1]
+
+async def read_banner(reader, delimiter=None, limit=BANNER_LIMIT, timeout=DETECT_TIMEOUT):
+    """
+    - 持續讀取直到遇到 delimiter、讀滿 limit、連線結束或逾時為止，回傳已讀到的內容。
+    - delimiter 為 None 時（非文字行協定）讀到第一個封包即返回。
+    - 遇到 delimiter 時截斷其後的內容（例如 SSH 識別字串後緊接的金鑰交換封包）。
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    data = b""
+    while len(data) < limit:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            chunk = await asyncio.wait_for(reader.read(limit - len(data)), remaining)
+        except asyncio.TimeoutError:
+            break
+        if not chunk:
+            break
+        data += chunk
+        if delimiter is None:
+            break
+        if delimiter in data:
+            data = data[:data.index(delimiter) + len(delimiter)]
+            break
+    return data
+
 class ServiceDetector:
-    def detect(self, ip, port):
-        """偵測指定 IP 和埠的服務，返回服務名稱和版本資訊"""
+    async def detect(self, reader, writer):
+        """沿用埠探測時建立的連線偵測服務，返回服務名稱和版本資訊"""
         return None, None
 
 class HTTPDetector(ServiceDetector):
-    def detect(self, ip, port):
+    async def detect(self, reader, writer):
+        ip, port = peer_address(writer)
         try:
-            conn = socket.create_connection((ip, port), timeout=2)
             request = f"GET / HTTP/1.1\r\nHost: {ip}\r\nConnection: close\r\n\r\n"
-            conn.send(request.encode())
-            response = conn.recv(1024).decode(errors='ignore')
+            writer.write(request.encode())
+            await writer.drain()
+            # 讀取完整標頭（直到空白行），不受單一封包大小限制
+            response = (await read_banner(reader, b"\r\n\r\n")).decode(errors='ignore')
             headers = response.split('\r\n')
             for header in headers:
                 if header.lower().startswith('server:'):
@@ -92,96 +206,107 @@ class HTTPDetector(ServiceDetector):
                     return service, None
             return "HTTP（未知 Web 伺服器）", None
         except Exception as e:
-            logging.error(f"HTTP 偵測失敗 {ip}:{port} - {e}")
+            logging.error("HTTP 偵測失敗 %s:%s - %s", ip, port, e)
             return "HTTP", None
 
+# TLS 設定只建立一次，避免每次偵測都重新載入 CA 憑證
+# 掃描時以 IP 連線，而憑證幾乎不會列出 IP，因此不檢查主機名稱；
+# 仍保留 CERT_REQUIRED，否則 getpeercert() 會是空的，無法取得發行者
+_TLS_CONTEXT = ssl.create_default_context()
+_TLS_CONTEXT.check_hostname = False
+
 class HTTPSDetector(ServiceDetector):
-    def detect(self, ip, port):
+    async def detect(self, reader, writer):
+        ip, port = peer_address(writer)
         try:
-            context = ssl.create_default_context()
-            with socket.create_connection((ip, port), timeout=2) as sock:
-                with context.wrap_socket(sock, server_hostname=ip) as ssock:
-                    cert = ssock.getpeercert()
-                    service = "HTTPS（SSL/TLS）"
-                    issuer = cert.get('issuer')
-                    if issuer:
-                        issuer_str = ", ".join(["=".join(item) for sublist in issuer for item in sublist])
-                        version_info = f"證書發行者：{issuer_str}"
-                        return service, version_info
-                    return service, None
+            # 直接在既有的 TCP 連線上升級為 TLS，不需重新握手連線
+            await asyncio.wait_for(writer.start_tls(_TLS_CONTEXT, server_hostname=ip), DETECT_TIMEOUT)
+            cert = writer.get_extra_info("peercert") or {}
+            service = "HTTPS（SSL/TLS）"
+            issuer = cert.get('issuer')
+            if issuer:
+                issuer_str = ", ".join(["=".join(item) for sublist in issuer for item in sublist])
+                version_info = f"證書發行者：{issuer_str}"
+                return service, version_info
+            return service, None
         except Exception as e:
-            logging.error(f"HTTPS 偵測失敗 {ip}:{port} - {e}")
+            logging.error("HTTPS 偵測失敗 %s:%s - %s", ip, port, e)
             return "HTTPS", None
 
 class SSHDetector(ServiceDetector):
-    def detect(self, ip, port):
+    async def detect(self, reader, writer):
+        ip, port = peer_address(writer)
         try:
-            with socket.create_connection((ip, port), timeout=2) as conn:
-                banner = conn.recv(1024).decode(errors='ignore').strip()
-                return "SSH", banner
+            banner = (await read_banner(reader, b"\n")).decode(errors='ignore').strip()
+            return "SSH", banner
         except Exception as e:
-            logging.error(f"SSH 偵測失敗 {ip}:{port} - {e}")
+            logging.error("SSH 偵測失敗 %s:%s - %s", ip, port, e)
             return "SSH", None
 
 class FTPDetector(ServiceDetector):
-    def detect(self, ip, port):
+    async def detect(self, reader, writer):
+        ip, port = peer_address(writer)
         try:
-            with socket.create_connection((ip, port), timeout=2) as conn:
-                banner = conn.recv(1024).decode(errors='ignore').strip()
-                return "FTP", banner
+            banner = (await read_banner(reader, b"\n")).decode(errors='ignore').strip()
+            return "FTP", banner
         except Exception as e:
-            logging.error(f"FTP 偵測失敗 {ip}:{port} - {e}")
+            logging.error("FTP 偵測失敗 %s:%s - %s", ip, port, e)
             return "FTP", None
 
 class TelnetDetector(ServiceDetector):
-    def detect(self, ip, port):
+    async def detect(self, reader, writer):
+        ip, port = peer_address(writer)
         try:
-            with socket.create_connection((ip, port), timeout=2) as conn:
-                banner = conn.recv(1024).decode(errors='ignore').strip()
-                return "Telnet", banner
+            banner = (await read_banner(reader)).decode(errors='ignore').strip()
+            return "Telnet", banner
         except Exception as e:
-            logging.error(f"Telnet 偵測失敗 {ip}:{port} - {e}")
+            logging.error("Telnet 偵測失敗 %s:%s - %s", ip, port, e)
             return "Telnet", None
 
 class MySQLDetector(ServiceDetector):
-    def detect(self, ip, port):
+    async def detect(self, reader, writer):
+        ip, port = peer_address(writer)
         try:
-            with socket.create_connection((ip, port), timeout=2) as conn:
-                banner = conn.recv(1024).decode(errors='ignore').strip()
-                return "MySQL 資料庫", banner
+            banner = (await read_banner(reader)).decode(errors='ignore').strip()
+            return "MySQL 資料庫", banner
         except Exception as e:
-            logging.error(f"MySQL 偵測失敗 {ip}:{port} - {e}")
+            logging.error("MySQL 偵測失敗 %s:%s - %s", ip, port, e)
             return "MySQL", None
 
 class GenericTCPDetector(ServiceDetector):
-    def detect(self, ip, port):
+    async def detect(self, reader, writer):
+        ip, port = peer_address(writer)
         try:
-            with socket.create_connection((ip, port), timeout=2) as conn:
-                conn.sendall(b'\n')
-                banner = conn.recv(1024).decode(errors='ignore').strip()
-                if banner:
-                    return banner, None
-                else:
-                    return "未知服務", None
+            writer.write(b'\n')
+            await writer.drain()
+            banner = (await read_banner(reader)).decode(errors='ignore').strip()
+            if banner:
+                return banner, None
+            else:
+                return "未知服務", None
         except Exception as e:
-            logging.error(f"通用服務偵測失敗 {ip}:{port} - {e}")
+            logging.error("通用服務偵測失敗 %s:%s - %s", ip, port, e)
             return "未知服務", None
 
 #----------------------------------------------------------------------
 #  4. 服務偵測器對應表 (常見埠)
 #----------------------------------------------------------------------
+# 直接對應到偵測器的 detect 方法，查表後即可呼叫，不需每次重新取得屬性
 DETECTORS = {
-    21: FTPDetector(),
-    22: SSHDetector(),
-    23: TelnetDetector(),
-    80: HTTPDetector(),
-    443: HTTPSDetector(),
-    3306: MySQLDetector(),
-    8080: HTTPDetector(),
-    8443: HTTPSDetector(),
+    21: FTPDetector().detect,
+    22: SSHDetector().detect,
+    23: TelnetDetector().detect,
+    80: HTTPDetector().detect,
+    443: HTTPSDetector().detect,
+    3306: MySQLDetector().detect,
+    8080: HTTPDetector().detect,
+    8443: HTTPSDetector().detect,
     # 可持續擴充...
 }
 
+# 未列於 DETECTORS 的埠共用同一個通用偵測器
+GENERIC_DETECTOR = GenericTCPDetector().detect
+
 #----------------------------------------------------------------------
 #  5. 常見埠與服務對應表（台灣繁體中文）
 #----------------------------------------------------------------------
@@ -282,6 +407,9 @@ SERVICE_MAP = {
     27021: {"service": "MongoDB 替代服務", "protocol": "TCP"},
 }
 
+# 預設掃描的埠（於載入模組時排序一次，以 uint16 陣列連續儲存）
+DEFAULT_PORTS = array.array('H', sorted(SERVICE_MAP))
+
 #----------------------------------------------------------------------
 #  6. 印出程式介紹
 #----------------------------------------------------------------------
@@ -363,6 +491,27 @@ def print_introduction():
 #----------------------------------------------------------------------
 #  7. 解析命令列參數
 #----------------------------------------------------------------------
+def port_number(value):
+    """argparse 使用的埠號型別，只接受 1-65535"""
+    port = int(value)
+    if not 1 <= port <= 65535:
+        raise argparse.ArgumentTypeError(f"埠號必須介於 1 到 65535 之間：{value}")
+    return port
+
+def positive_int(value):
+    """argparse 使用的正整數型別（例如連線上限，0 會讓掃描永遠等待）"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"必須為正整數：{value}")
+    return number
+
+def positive_seconds(value):
+    """argparse 使用的秒數型別，只接受大於 0 的數值"""
+    seconds = float(value)
+    if not seconds > 0:
+        raise argparse.ArgumentTypeError(f"秒數必須大於 0：{value}")
+    return seconds
+
 def parse_arguments():
     """解析命令列參數"""
     parser = argparse.ArgumentParser(
@@ -380,21 +529,96 @@ def parse_arguments():
         "-p",
         "--ports",
         nargs='*',
-        type=int,
-        default=sorted(SERVICE_MAP.keys()),
+        type=port_number,
+        default=DEFAULT_PORTS,
         help="指定要掃描的埠，預設為常見埠列表。",
     )
     parser.add_argument(
         "--html",
         help="輸出 HTML 報告的名稱（若不指定，將自動生成 IP_日期時間.html）",
     )
+    parser.add_argument(
+        "--ping",
+        action="store_true",
+        help="改用 ping 探測活躍機器：優先使用 fping 或 scapy ARP 廣播，皆無法使用時才逐一呼叫系統 ping（預設使用 TCP 連線探測，不需額外權限）",
+    )
+    parser.add_argument(
+        "--arp-ttl",
+        type=positive_seconds,
+        default=ARP_CACHE_TTL,
+        help=f"MAC 位址快取的有效秒數（須大於 0），預設為 {ARP_CACHE_TTL} 秒",
+    )
+    parser.add_argument(
+        "-c",
+        "--per-host-concurrency",
+        type=positive_int,
+        default=PER_HOST_CONCURRENCY,
+        help=f"單一主機同時進行的埠連線上限，預設為 {PER_HOST_CONCURRENCY}",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help=f"不使用 asyncio 掃描埠，改以 selectors 每批 {SYNC_BATCH_SIZE} 個非阻塞連線共用逾時等待",
+    )
     return parser.parse_args()
 
 #----------------------------------------------------------------------
-#  8. Ping 探測 IP
+#  8. 探測 IP 是否活躍 (TCP 連線探測，保留 ping 作為備援)
 #----------------------------------------------------------------------
+# SO_LINGER(啟用, 0 秒)：關閉時直接送出 RST，不讓大量探測連線停留在 TIME_WAIT 佔用本機埠
+_LINGER_RESET = struct.pack("HH" if sys.platform.startswith("win") else "ii", 1, 0)
+
+def new_probe_socket(ip):
+    """建立探測用的非阻塞 socket（關閉 Nagle、關閉時立即釋放本機埠）"""
+    family = socket.AF_INET6 if ":" in ip else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    # 小型的探測請求（例如 HTTP GET）不需等待 Nagle 合併封包
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, _LINGER_RESET)
+    return sock
+
+async def open_probe_connection(ip, port, timeout):
+    """以 new_probe_socket 建立連線，並包裝成 asyncio 的 (reader, writer)"""
+    sock = new_probe_socket(ip)
+    try:
+        await asyncio.wait_for(asyncio.get_running_loop().sock_connect(sock, (ip, port)), timeout)
+        return await asyncio.open_connection(sock=sock)
+    except BaseException:
+        sock.close()
+        raise
+
+async def tcp_probe(ip, port, sem, timeout=DISCOVERY_TIMEOUT):
+    """以 TCP 連線探測主機，連線成功或被拒（主機回覆 RST）皆視為存活"""
+    async with sem:
+        try:
+            _, writer = await open_probe_connection(ip, port, timeout)
+        except ConnectionRefusedError:
+            return True
+        except (asyncio.TimeoutError, OSError):
+            return False
+        writer.close()
+        return True
+
+async def probe_host(ip, sem):
+    """同時對 DISCOVERY_PORTS 發出探測，任一埠有回應即視為存活"""
+    results = await asyncio.gather(*(tcp_probe(ip, port, sem) for port in DISCOVERY_PORTS))
+    return ip, any(results)
+
+async def discover(hosts, concurrency=DISCOVERY_CONCURRENCY, on_result=None):
+    """以單一事件迴圈探測所有主機，回傳活躍的 IP 列表"""
+    sem = asyncio.Semaphore(concurrency)
+    active_hosts = []
+    for coro in asyncio.as_completed([probe_host(str(ip), sem) for ip in hosts]):
+        ip, alive = await coro
+        if alive:
+            active_hosts.append(ip)
+        if on_result:
+            on_result(ip)
+    return active_hosts
+
 def ping_ip(ip):
-    """Ping 探測 IP 是否活躍"""
+    """Ping 探測 IP 是否活躍（--ping 模式的備援方式）"""
     try:
         param = "-n" if sys.platform.startswith("win") else "-c"
         if sys.platform == "darwin":
@@ -407,595 +631,504 @@ def ping_ip(ip):
         if result.returncode == 0:
             return str(ip)
     except Exception as e:
-        logging.error(f"Ping {ip} 失敗: {e}")
+        logging.error("Ping %s 失敗: %s", ip, e)
+    return None
+
+def fping_sweep(hosts):
+    """以單一 fping 行程探測所有主機；系統未安裝 fping 或執行失敗時回傳 None"""
+    fping = shutil.which("fping")
+    if not fping:
+        return None
+    try:
+        result = subprocess.run(
+            [fping, "-a", "-q", "-r", "1", "-t", "500"],
+            input="\n".join(str(ip) for ip in hosts),
+            capture_output=True,
+            text=True,
+        )
+    except Exception as e:
+        logging.error("執行 fping 失敗: %s", e)
+        return None
+    # fping 在部分主機無回應時回傳 1，大於 1 才是執行錯誤
+    if result.returncode > 1:
+        logging.error("執行 fping 失敗: %s", result.stderr.strip())
+        return None
+    return [line.strip() for line in result.stdout.splitlines() if line.strip()]
+
+def arp_sweep(hosts, timeout=2):
+    """以 scapy 送出一次 ARP 廣播，回傳同網段內活躍主機的 {ip: mac}；無法使用時回傳 None"""
+    try:
+        # scapy 載入較慢，只在需要時才匯入
+        from scapy.all import ARP, Ether, srp
+    except ImportError:
+        return None
+    try:
+        answered, _ = srp(
+            Ether(dst="ff:ff:ff:ff:ff:ff") / ARP(pdst=[str(ip) for ip in hosts]),
+            timeout=timeout,
+            verbose=0,
+        )
+    except Exception as e:
+        # 送出原始封包需要系統管理員權限
+        logging.error("ARP 廣播探測失敗: %s", e)
+        return None
+    return {received.psrc: received.hwsrc.lower() for _, received in answered}
+
+def batch_ping(hosts, arp_ttl=ARP_CACHE_TTL):
+    """
+    - 以單一批次探測所有主機，避免每個 IP 各啟動一個 ping 行程。
+    - 優先使用 fping；其次以 scapy 進行 ARP 廣播（順便記下 MAC 位址）。
+    - 兩者皆無法使用（或 ARP 沒有任何回應，例如目標不在同一網段）時回傳 None。
+    """
+    active_hosts = fping_sweep(hosts)
+    if active_hosts is not None:
+        return active_hosts
+
+    arp_table = arp_sweep(hosts)
+    if arp_table:
+        expiry = time.monotonic() + arp_ttl
+        for ip, mac in arp_table.items():
+            _MAC_CACHE[ip] = (mac, expiry)
+        return list(arp_table)
     return None
 
 #----------------------------------------------------------------------
-#  9. 取得 MAC 位址
+#  9. 取得 MAC 位址 (一次讀取系統 ARP 表)
 #----------------------------------------------------------------------
-def get_mac_address(ip):
-    """取得 MAC 位址"""
+def load_arp_table():
+    """一次讀取系統 ARP 表，回傳 {ip: mac}"""
+    arp_table = {}
     try:
-        if sys.platform.startswith("win"):
-            arp_output = subprocess.check_output(["arp", "-a", ip], universal_newlines=True)
-        elif sys.platform == "darwin":
-            arp_output = subprocess.check_output(["arp", ip], universal_newlines=True)
+        if os.path.exists("/proc/net/arp"):
+            # Linux：直接讀取核心的 ARP 表，不需啟動任何子行程
+            with open("/proc/net/arp", encoding="utf-8") as f:
+                for line in f.read().splitlines()[1:]:
+                    fields = line.split()
+                    # 未完成解析的紀錄 MAC 會是全 0，略過
+                    if len(fields) >= 4 and fields[3] != "00:00:00:00:00:00":
+                        arp_table[fields[0]] = fields[3].lower()
         else:
-            arp_output = subprocess.check_output(["arp", "-n", ip], universal_newlines=True)
-
-        match = re.search(r"(([0-9a-fA-F]{1,2}[:\-]){5}[0-9a-fA-F]{1,2})", arp_output)
-        if match:
-            return match.group(1).lower().replace('-', ':')
+            # macOS / BSD / Windows：只執行一次 arp 取得完整表格
+            arp_output = subprocess.check_output(_ARP_ARGS, universal_newlines=True)
+            for line in arp_output.splitlines():
+                ip_match = _IPV4_RE.search(line)
+                mac_match = _MAC_RE.search(line)
+                if ip_match and mac_match:
+                    arp_table[ip_match.group(1)] = mac_match.group(1).lower().replace('-', ':')
     except subprocess.CalledProcessError:
         pass
     except Exception as e:
-        logging.error(f"取得 {ip} 的 MAC 位址時出錯: {e}")
+        logging.error("讀取 ARP 表時出錯: %s", e)
+    return arp_table
+
+def refresh_arp_table(ttl=ARP_CACHE_TTL):
+    """讀取系統 ARP 表並更新 MAC 位址快取"""
+    expiry = time.monotonic() + ttl
+    for ip, mac in load_arp_table().items():
+        _MAC_CACHE[ip] = (mac, expiry)
+
+def get_mac_address(ip):
+    """取得 MAC 位址（由 refresh_arp_table 建立的快取查詢）"""
+    cached = _MAC_CACHE.get(ip)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
     return "未知"
 
 #----------------------------------------------------------------------
 #  10. 偵測服務
 #----------------------------------------------------------------------
-def detect_service(ip, port):
-    """根據埠和協定偵測服務"""
-    detector = DETECTORS.get(port, GenericTCPDetector())
-    service, version_info = detector.detect(ip, port)
+async def detect_service(reader, writer, port):
+    """根據埠和協定偵測服務（沿用埠探測時建立的連線）"""
+    detect = DETECTORS.get(port, GENERIC_DETECTOR)
+    service, version_info = await detect(reader, writer)
     return service, version_info
 
 #----------------------------------------------------------------------
 #  11. 掃描指定 IP/Port
 #----------------------------------------------------------------------
-def scan_port(ip, port):
-    """掃描指定 IP 的指定埠是否開放，並偵測服務"""
+_INFLIGHT = {}  # 進行中的埠掃描：{(ip, port): [Task, 等待者數]}
+_PORT_TIMEOUT = object()  # scan_port 連線逾時（封包被丟棄）時回傳的標記，與連線被拒的 None 區分
+
+async def scan_port(ip, port, sem, host_sem, on_connect=None):
+    """
+    - 掃描指定 IP 的指定埠是否開放，並偵測服務。
+    - 開放時回傳 (port, service, version)，連線被拒回傳 None，逾時回傳 _PORT_TIMEOUT。
+    - 同一目標已在掃描中時直接等待同一個結果；CLI 的埠清單已去重，這只在同一行程內
+      重複或重疊呼叫掃描時才會發生。
+    - 單一等待者被取消不影響其他等待者，最後一位等待者離開時才取消實際的探測。
+    - on_connect(port) 在連線建立、開始偵測服務前呼叫（共用探測時只會呼叫第一位等待者的）。
+    """
+    key = (ip, port)
+    entry = _INFLIGHT.get(key)
+    if entry is None:
+        entry = [asyncio.ensure_future(probe_port(ip, port, sem, host_sem, on_connect)), 0]
+        _INFLIGHT[key] = entry
+
+        def forget(_):
+            if _INFLIGHT.get(key) is entry:
+                del _INFLIGHT[key]
+
+        entry[0].add_done_callback(forget)
+    task = entry[0]
+    entry[1] += 1
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(1)
-            result = s.connect_ex((ip, port))
-            if result == 0:
-                service, version = detect_service(ip, port)
-                return (port, service, version)
-    except Exception as e:
-        logging.error(f"掃描 {ip}:{port} 時出錯: {e}")
-    return None
+        return await asyncio.shield(task)
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0 and not task.done():
+            task.cancel()
+            if _INFLIGHT.get(key) is entry:
+                del _INFLIGHT[key]
+
+async def probe_port(ip, port, sem, host_sem, on_connect=None):
+    """實際連線指定埠並偵測服務"""
+    # 先取得單一主機的名額再佔用全域名額，避免等待中的主機佔住全域連線數
+    async with host_sem, sem:
+        try:
+            reader, writer = await open_probe_connection(ip, port, PORT_SCAN_TIMEOUT)
+        except asyncio.TimeoutError:
+            return _PORT_TIMEOUT
+        except OSError:
+            return None
+        if on_connect:
+            on_connect(port)
+        # 連線成功後直接交給偵測器使用同一條連線，省去第二次 TCP 握手
+        try:
+            service, version = await detect_service(reader, writer, port)
+        finally:
+            writer.close()
+    return (port, service, version)
+
+async def scan_host_ports(ip, port_list, sem, host_sem, on_result=None):
+    """
+    - 掃描單一主機的所有埠，回傳開放埠列表（依完成順序）。
+    - 連續 FILTERED_PORT_LIMIT 個埠逾時，視為主機被防火牆過濾，取消其餘尚未連線的埠。
+    - 「連續」是依完成順序計算（同時進行的探測最多 per-host 上限個），與埠號順序無關。
+    - 已連線、正在偵測服務的埠不會被取消，避免遺漏開放的埠。
+    """
+    open_ports = []
+    timeouts = 0
+    connected = set()
+
+    async def run(port):
+        nonlocal timeouts
+        try:
+            result = await scan_port(ip, port, sem, host_sem, on_connect=connected.add)
+        except Exception as e:
+            logging.error("掃描 %s:%s 時出錯: %s", ip, port, e)
+            result = None
+        if result is _PORT_TIMEOUT:
+            timeouts += 1
+            if timeouts == FILTERED_PORT_LIMIT:
+                skip_remaining()
+        else:
+            # 有回應（開放或被拒）代表封包沒有被丟棄，重新計算
+            timeouts = 0
+            if result:
+                open_ports.append(result)
+        if on_result:
+            on_result(ip, port)
+
+    def skip_remaining():
+        current = asyncio.current_task()
+        pending = [
+            task for port, task in zip(port_list, tasks)
+            if task is not current and not task.done() and port not in connected
+        ]
+        if pending:
+            logging.info("%s 連續 %d 個埠逾時，略過其餘 %d 個埠", ip, FILTERED_PORT_LIMIT, len(pending))
+        for task in pending:
+            task.cancel()
+
+    tasks = [asyncio.ensure_future(run(port)) for port in port_list]
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if on_result:
+        # 被略過的埠也要計入進度
+        for task, port in zip(tasks, port_list):
+            if task.cancelled():
+                on_result(ip, port)
+    return open_ports
+
+# 非阻塞 connect 尚在進行中時回傳的錯誤碼（Windows 為 WSAEWOULDBLOCK）
+_CONNECT_IN_PROGRESS = {0, errno.EINPROGRESS, errno.EWOULDBLOCK, getattr(errno, "WSAEWOULDBLOCK", errno.EWOULDBLOCK)}
+
+def batch_connect(targets, timeout=PORT_SCAN_TIMEOUT):
+    """
+    - 對 targets 中的每個 (IP, 埠) 同時送出非阻塞 connect，並以 selectors 共用同一個截止時間等待。
+    - 未開放或被過濾的埠最多只等待一次 timeout，而非每個埠各等待一次。
+    - 回傳已連線成功的 [((ip, port), sock), ...]，其餘 socket 皆會關閉。
+    """
+    sel = selectors.DefaultSelector()
+    connected = []
+    done = False
+    try:
+        for ip, port in targets:
+            # 單一目標出錯（例如檔案描述元用盡、埠號超出範圍）只略過該目標，不中斷整批
+            sock = None
+            try:
+                sock = new_probe_socket(ip)
+                if sock.connect_ex((ip, port)) in _CONNECT_IN_PROGRESS:
+                    sel.register(sock, selectors.EVENT_WRITE, (ip, port))
+                    sock = None
+            except (OSError, OverflowError) as e:
+                logging.error("連線 %s:%s 時出錯: %s", ip, port, e)
+            if sock is not None:
+                sock.close()
+
+        deadline = time.monotonic() + timeout
+        while sel.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in sel.select(remaining):
+                sock = key.fileobj
+                sel.unregister(sock)
+                if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                    connected.append((key.data, sock))
+                else:
+                    sock.close()
+        done = True
+    finally:
+        # 逾時仍未完成的連線一律視為未開放
+        for key in list(sel.get_map().values()):
+            key.fileobj.close()
+        sel.close()
+        # 發生例外中斷時，已連線的 socket 不會交給呼叫端，需在此關閉
+        if not done:
+            for _, sock in connected:
+                sock.close()
+    return connected
+
+async def detect_connected(connected):
+    """對 batch_connect 已建立的連線進行服務偵測，回傳 [(ip, (port, service, version)), ...]"""
+    async def run(ip, port, sock):
+        try:
+            reader, writer = await asyncio.open_connection(sock=sock)
+        except Exception as e:
+            logging.error("掃描 %s:%s 時出錯: %s", ip, port, e)
+            sock.close()
+            return ip, (port, None, None)
+        try:
+            service, version = await detect_service(reader, writer, port)
+        finally:
+            writer.close()
+        return ip, (port, service, version)
+
+    return await asyncio.gather(*(run(ip, port, sock) for (ip, port), sock in connected))
 
 #----------------------------------------------------------------------
 #  12. 匯出 CSV
 #----------------------------------------------------------------------
-def export_to_csv(host_info, filename="scan_results.csv"):
+def ip_sort_key(ip):
+    """IP 排序用的鍵值（轉為整數直接比較）"""
+    return int(ipaddress.ip_address(ip))
+
+def host_order(host_info, order=None):
+    """報告輸出的主機順序：呼叫端已提供依 IP 排序的清單時直接沿用，否則才排序"""
+    return order if order is not None else sorted(host_info, key=ip_sort_key)
+
+def format_port_service(port, service, version):
+    """將單一開放埠格式化為「埠 (服務) [版本]」"""
+    service_str = f"{port}"
+    if service:
+        service_str += f" ({service})"
+    if version:
+        # 限制版本資訊長度，避免過長影響美觀
+        version = (version[:30] + '...') if len(version) > 30 else version
+        service_str += f" [{version}]"
+    return service_str
+
+def format_open_ports(open_ports):
+    """將主機的開放埠（已由 port_scan 依埠號排序）串成一行，沒有開放埠時為「無」"""
+    return ", ".join(
+        format_port_service(port, service, version)
+        for port, service, version in open_ports
+    ) or "無"
+
+def export_to_csv(host_info, filename="scan_results.csv", order=None):
     """將掃描結果輸出為 CSV 檔案"""
     try:
         with open(filename, mode="w", newline="", encoding="utf-8") as csvfile:
-            fieldnames = ["IP 位址", "MAC 位址", "開放的埠及服務"]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-            writer.writeheader()
-            for ip in sorted(host_info.keys(), key=lambda x: socket.inet_aton(x)):
+            writer = csv.writer(csvfile)
+            writer.writerow(("IP 位址", "MAC 位址", "開放的埠及服務"))
+            # 依 IP 順序逐列寫入檔案
+            for ip in host_order(host_info, order):
                 info = host_info[ip]
-                port_service_list = []
-                for port, service, version in sorted(info.get("open_ports", []), key=lambda x: x[0]):
-                    service_str = f"{port}"
-                    if service:
-                        service_str += f" ({service})"
-                    if version:
-                        # 限制版本資訊長度，避免過長影響美觀
-                        version = (version[:30] + '...') if len(version) > 30 else version
-                        service_str += f" [{version}]"
-                    port_service_list.append(service_str)
-                open_ports_services = ", ".join(port_service_list) if port_service_list else "無"
-                writer.writerow(
-                    {
-                        "IP 位址": ip,
-                        "MAC 位址": info.get("mac_address", "未知"),
-                        "開放的埠及服務": open_ports_services,
-                    }
-                )
+                writer.writerow((
+                    ip,
+                    info.get("mac_address", "未知"),
+                    format_open_ports(info.get("open_ports", ())),
+                ))
         console.print(f"[bold green]成功輸出掃描結果至 [underline]{filename}[/underline][/bold green]")
     except Exception as e:
-        logging.error(f"輸出 CSV 失敗：{e}")
+        logging.error("輸出 CSV 失敗：%s", e)
         console.print(f"[bold red]輸出 CSV 失敗：{e}[/bold red]")
 
 #----------------------------------------------------------------------
 #  13. 產生統計數據
 #----------------------------------------------------------------------
 def generate_statistics(host_info):
-    """生成統計數據"""
-    service_counts = {}
-    total_open_ports = 0
-    for info in host_info.values():
-        for port, service, version in info.get('open_ports', []):
-            total_open_ports += 1
-            service_name = service if service else "未知服務"
-            service_counts[service_name] = service_counts.get(service_name, 0) + 1
-    return service_counts, total_open_ports
+    """生成統計數據（回傳各服務出現次數的 Counter 與開放埠總數）"""
+    service_counts = Counter(
+        service or "未知服務"
+        for info in host_info.values()
+        for _, service, _ in info.get('open_ports', ())
+    )
+    return service_counts, sum(service_counts.values())
 
 #----------------------------------------------------------------------
 #  14. 匯出 HTML 報告
 #----------------------------------------------------------------------
-def export_to_html(host_info, filename="scan_report.html", target=""):
+# 定義服務到顏色與圖示的映射
+SERVICE_STYLES = {
+    "ssh": {"color": "info", "icon": "bi-terminal"},
+    "mysql": {"color": "success", "icon": "bi-database"},
+    "ftp": {"color": "warning", "icon": "bi-file-earmark-arrow-up"},
+    "apache": {"color": "primary", "icon": "bi-server"},
+    "nginx": {"color": "primary", "icon": "bi-server"},
+    "rdp": {"color": "danger", "icon": "bi-display"},
+    "mssql": {"color": "danger", "icon": "bi-display"},
+    "http": {"color": "warning", "icon": "bi-globe"},
+    "https": {"color": "warning", "icon": "bi-globe2"},
+    "microsoft-iis": {"color": "dark", "icon": "bi-server"},
+    "mysql 資料庫": {"color": "success", "icon": "bi-database"},
+    "http/1.1 400 bad request": {"color": "danger", "icon": "bi-exclamation-triangle"},
+    "rfb 003.008": {"color": "secondary", "icon": "bi-display"},
+    "unknown": {"color": "secondary", "icon": "bi-question-circle"},
+}
+
+# 每種服務樣式預先組成徽章 HTML 的格式字串，輸出時只需查表並以 % 代入已跳脫的文字
+_BADGE_FMT = {
+    name: (
+        f'<span class="badge bg-{style["color"]} badge-service" data-bs-toggle="tooltip" '
+        f'data-bs-placement="top" title="%(title)s"><i class="{style["icon"]}"></i> %(label)s</span>'
+    )
+    for name, style in SERVICE_STYLES.items()
+}
+
+@lru_cache(maxsize=None)
+def service_style_key(service):
+    """服務名稱對應的 SERVICE_STYLES 鍵值（未定義的服務歸為 unknown）"""
+    key = service.lower() if service else "unknown"
+    return key if key in SERVICE_STYLES else "unknown"
+
+def build_report_rows(host_info, order=None):
+    """依 IP 排序並將每個開放埠展開為徽章資料
+    - label：徽章文字「埠 (服務) [版本]」，版本已截斷
+    - title：提示框顯示的完整服務與版本
+    - style / color / icon：依服務類型決定的樣式
+    """
+    rows = []
+    for ip in host_order(host_info, order):
+        info = host_info[ip]
+        badges = []
+        for port, service, version in info.get("open_ports", ()):
+            key = service_style_key(service)
+            style = SERVICE_STYLES[key]
+            badges.append({
+                "label": format_port_service(port, service, version),
+                "title": f"{service or ''} [{version}]" if version else (service or ""),
+                "style": key,
+                "color": style["color"],
+                "icon": style["icon"],
+            })
+        rows.append({"ip": ip, "mac_address": info.get("mac_address", "未知"), "badges": badges})
+    return rows
+
+def render_badges(badges):
+    """以 _BADGE_FMT 產生靜態表格使用的徽章 HTML（沒有開放埠時為空字串）"""
+    return Markup("".join(
+        _BADGE_FMT[b["style"]] % {"title": escape(b["title"]), "label": escape(b["label"])}
+        for b in badges
+    ))
+
+# 內嵌於 <script> 的 JSON 需跳脫這些字元，避免字串內容提早結束 script 標籤（與 Jinja 的 |tojson 相同）
+_JSON_HTML_ESCAPES = {ord("<"): "\\u003c", ord(">"): "\\u003e", ord("&"): "\\u0026", ord("'"): "\\u0027"}
+
+def script_json(value):
+    """序列化為可直接嵌入 <script> 的 JSON（已安裝 orjson 時使用 orjson，否則使用標準函式庫）"""
+    if orjson is not None:
+        text = orjson.dumps(value).decode()
+    else:
+        text = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    return Markup(text.translate(_JSON_HTML_ESCAPES))
+
+@lru_cache(maxsize=None)
+def report_template():
+    """取得已編譯的 HTML 報告模板（每個行程只編譯一次）"""
+    return _JINJA.get_template(REPORT_TEMPLATE)
+
+def export_to_html(host_info, filename="scan_report.html", target="", order=None):
     """將掃描結果輸出為 HTML 報告"""
     try:
         service_counts, total_open_ports = generate_statistics(host_info)
         total_hosts = len(host_info)
         service_types = len(service_counts)
-        most_common_service = max(service_counts, key=service_counts.get) if service_counts else "無"
-        chart_labels = list(service_counts.keys())
-        chart_data = list(service_counts.values())
-
-        # 定義服務到顏色與圖示的映射
-        service_styles = {
-            "ssh": {"color": "info", "icon": "bi-terminal"},
-            "mysql": {"color": "success", "icon": "bi-database"},
-            "ftp": {"color": "warning", "icon": "bi-file-earmark-arrow-up"},
-            "apache": {"color": "primary", "icon": "bi-server"},
-            "nginx": {"color": "primary", "icon": "bi-server"},
-            "rdp": {"color": "danger", "icon": "bi-display"},
-            "mssql": {"color": "danger", "icon": "bi-display"},
-            "http": {"color": "warning", "icon": "bi-globe"},
-            "https": {"color": "warning", "icon": "bi-globe2"},
-            "microsoft-iis": {"color": "dark", "icon": "bi-server"},
-            "mysql 資料庫": {"color": "success", "icon": "bi-database"},
-            "http/1.1 400 bad request": {"color": "danger", "icon": "bi-exclamation-triangle"},
-            "rfb 003.008": {"color": "secondary", "icon": "bi-display"},
-            "unknown": {"color": "secondary", "icon": "bi-question-circle"},
-        }
-
-        env = Environment(
-            loader=FileSystemLoader('.'),
-            autoescape=select_autoescape(['html', 'xml'])
-        )
-        template = env.from_string("""
-        <!DOCTYPE html>
-        <html lang="zh-TW">
-        <head>
-            <meta charset="UTF-8">
-            <title>網路掃描報告</title>
-            <meta name="viewport" content="width=device-width, initial-scale=1">
-            <!-- Bootstrap CSS -->
-            <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css" rel="stylesheet">
-            <!-- Simple-DataTables CSS -->
-            <link href="https://cdn.jsdelivr.net/npm/simple-datatables@latest/dist/style.css" rel="stylesheet">
-            <!-- Bootstrap Icons -->
-            <link href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.0/font/bootstrap-icons.css" rel="stylesheet">
-            <style>
-                body {
-                    padding: 20px;
-                    background-color: #f8f9fa;
-                }
-                h1, h2 {
-                    text-align: center;
-                    margin-bottom: 30px;
-                }
-                .card-icon {
-                    font-size: 1.5rem;
-                    margin-right: 10px;
-                }
-                .summary-card {
-                    display: flex;
-                    align-items: center;
-                }
-                table th {
-                    white-space: nowrap;
-                    text-align: left;
-                    font-size: 1rem;
-                }
-                table td {
-                    vertical-align: top;
-                    text-align: left;
-                    font-size: 0.95rem;
-                    background-color: #e9ecef; /* 淺灰色背景 */
-                }
-                .table-responsive {
-                    overflow-x: auto;
-                }
-                .card-title {
-                    font-size: 1.1rem;
-                    font-weight: bold;
-                }
-                .card-text {
-                    font-size: 1rem;
-                }
-                .badge-service {
-                    margin-bottom: 5px;
-                    padding: 0.3em 0.5em;
-                    font-size: 0.85rem;
-                    display: flex;
-                    align-items: center;
-                    width: fit-content;
-                }
-                .badge-service i {
-                    margin-right: 5px;
-                }
-                .dataTables_wrapper .dataTables_paginate {
-                    margin-top: 15px;
-                }
-                .dataTables_wrapper .dataTables_filter input {
-                    width: 100%;
-                    max-width: 300px;
-                    margin-left: 0.5em;
-                }
-                .dataTables_wrapper .dataTables_length select {
-                    width: auto;
-                    display: inline-block;
-                    margin-left: 0.5em;
-                }
-                .dataTables_wrapper .dataTables_paginate .paginate_button {
-                    padding: 0.5em 0.75em;
-                    margin-left: 0.25em;
-                    border: 1px solid #dee2e6;
-                    border-radius: 0.25rem;
-                    background-color: #ffffff;
-                    color: #0d6efd;
-                    cursor: pointer;
-                }
-                .dataTables_wrapper .dataTables_paginate .paginate_button.current {
-                    background-color: #0d6efd;
-                    color: #ffffff;
-                }
-                .dataTables_wrapper .dataTables_paginate .paginate_button:hover {
-                    background-color: #e9ecef;
-                }
-                .badge-container {
-                    display: flex;
-                    flex-direction: column;
-                    align-items: flex-start;
-                }
-                .badge-service.bg-info {
-                    background-color: #17a2b8;
-                }
-                .badge-service.bg-warning {
-                    background-color: #ffc107;
-                }
-                .badge-service.bg-danger {
-                    background-color: #dc3545;
-                }
-                .badge-service.bg-success {
-                    background-color: #198754;
-                }
-                .badge-service.bg-primary {
-                    background-color: #0d6efd;
-                }
-                .badge-service.bg-secondary {
-                    background-color: #6c757d;
-                }
-            </style>
-        </head>
-        <body>
-            <div class="container my-5">
-                <h1 class="mb-4"><i class="bi bi-laptop-fill me-2"></i>網路掃描報告</h1>
-                <div class="row mb-5">
-            <!-- 生成時間 -->
-            <div class="col-12 col-lg-6 col-xxl-4 mb-4">
-                <div class="card shadow-sm h-100">
-                    <div class="card-body d-flex align-items-center">
-                        <i class="bi bi-clock-fill fs-3 text-primary me-3"></i>
-                        <div class="d-flex justify-content-between align-items-center flex-grow-1">
-                            <h5 class="card-title mb-0">生成時間：</h5>
-                            <p class="card-text fs-5 fw-bold mb-0 text-primary">{{ scan_time }}</p>
-                        </div>
-                    </div>
-                </div>
-            </div>
-
-            <!-- 掃描目標 -->
-            <div class="col-12 col-lg-6 col-xxl-4 mb-4">
-                <div class="card shadow-sm h-100">
-                    <div class="card-body d-flex align-items-center">
-                        <i class="bi bi-router fs-3 text-success me-3"></i>
-                        <div class="d-flex justify-content-between align-items-center flex-grow-1">
-                            <h5 class="card-title mb-0">掃描目標：</h5>
-                            <p class="card-text fs-5 fw-bold mb-0 text-success">{{ target }}</p>
-                        </div>
-                    </div>
-                </div>
-            </div>
-
-            <!-- 活躍機器數量 -->
-            <div class="col-12 col-lg-6 col-xxl-4 mb-4">
-                <div class="card shadow-sm h-100">
-                    <div class="card-body d-flex align-items-center">
-                        <i class="bi bi-robot fs-3 text-secondary me-3"></i>
-                        <div class="d-flex justify-content-between align-items-center flex-grow-1">
-                            <h5 class="card-title mb-0">活躍機器數量：</h5>
-                            <p class="card-text fs-5 fw-bold mb-0 text-secondary">{{ active_hosts_count }}</p>
-                        </div>
-                    </div>
-                </div>
-            </div>
-
-            <!-- 總開放埠數 -->
-            <div class="col-12 col-lg-6 col-xxl-4 mb-4">
-                <div class="card shadow-sm h-100">
-                    <div class="card-body d-flex align-items-center">
-                        <i class="bi bi-patch-exclamation-fill fs-3 text-danger me-3"></i>
-                        <div class="d-flex justify-content-between align-items-center flex-grow-1">
-                            <h5 class="card-title mb-0">總開放埠數：</h5>
-                            <p class="card-text fs-5 fw-bold mb-0 text-danger">{{ total_open_ports }}</p>
-                        </div>
-                    </div>
-                </div>
-            </div>
-
-            <!-- 服務類型數量 -->
-            <div class="col-12 col-lg-6 col-xxl-4 mb-4">
-                <div class="card shadow-sm h-100">
-                    <div class="card-body d-flex align-items-center">
-                        <i class="bi bi-bar-chart-fill fs-3 text-info me-3"></i>
-                        <div class="d-flex justify-content-between align-items-center flex-grow-1">
-                            <h5 class="card-title mb-0">服務類型數量：</h5>
-                            <p class="card-text fs-5 fw-bold mb-0 text-info">{{ service_types }}</p>
-                        </div>
-                    </div>
-                </div>
-            </div>
-
-            <!-- 最常見的服務 -->
-            <div class="col-12 col-lg-6 col-xxl-4 mb-4">
-                <div class="card shadow-sm h-100">
-                    <div class="card-body d-flex align-items-center">
-                        <i class="bi bi-tools fs-3 text-warning me-3"></i>
-                        <div class="d-flex justify-content-between align-items-center flex-grow-1">
-                            <h5 class="card-title mb-0">最常見的服務：</h5>
-                            <p class="card-text fs-5 fw-bold mb-0 text-warning">{{ most_common_service }}</p>
-                        </div>
-                    </div>
-                </div>
-            </div>
-        </div>
-                
-        <div class="row mb-5 justify-content-center">
-            <div class="col-12">
-                <h2 class="mb-4">
-                    <i class="bi bi-pie-chart-fill me-2"></i>服務分佈圖
-                </h2>
-            </div>
-            <div class="col-12 col-md-8 col-lg-6">
-                <canvas id="servicePieChart"></canvas>
-            </div>
-        </div>
-
-        <h2 class="mb-4"><i class="bi bi-info-circle-fill me-2"></i>主機詳細資訊</h2>
-        <div class="table-responsive mb-5">
-            <table id="hostTable" class="table table-striped table-bordered table-hover">
-                <thead>
-                    <tr>
-                        <th><i class="bi bi-wifi card-icon"></i>IP 位址</th>
-                        <th><i class="bi bi-hdd-network card-icon"></i>MAC 位址</th>
-                        <th><i class="bi bi-cloud card-icon"></i>開放的埠及服務</th>
-                    </tr>
-                </thead>
-                <tbody>
-                    {% for ip, info in sorted_host_info %}
-                    <tr>
-                        <td>{{ ip }}</td>
-                        <td>{{ info.mac_address }}</td>
-                        <td>
-                            {% if info.open_ports %}
-                                <div class="badge-container">
-                                    {% for port, service, version in info.open_ports %}
-                                        {% set service_key = service.lower() if service else "unknown" %}
-                                        {% set style = service_styles.get(service_key, service_styles['unknown']) %}
-                                        <span class="badge bg-{{ style.color }} badge-service" 
-                                              data-bs-toggle="tooltip" 
-                                              data-bs-placement="top" 
-                                              title="{{ service }}{% if version %} [{{ version }}]{% endif %}">
-                                            <i class="{{ style.icon }}"></i> {{ port }} 
-                                            {% if service %}
-                                                ({{ service }})
-                                            {% endif %}
-                                            {% if version %}
-                                                [{{ version }}]
-                                            {% endif %}
-                                        </span>
-                                    {% endfor %}
-                                </div>
-                            {% else %}
-                                <span class="badge bg-secondary">無</span>
-                            {% endif %}
-                        </td>
-                    </tr>
-                    {% endfor %}
-                </tbody>
-            </table>
-        </div>
-                
-        <h2 class="mb-4"><i class="bi bi-bar-chart-fill me-2"></i>服務統計</h2>
-        <div class="table-responsive mb-5">
-            <table id="serviceTable" class="table table-striped table-bordered table-hover">
-                <thead>
-                    <tr>
-                        <th><i class="bi bi-tools card-icon"></i>服務名稱</th>
-                        <th><i class="bi bi-graph-up card-icon"></i>開放次數</th>
-                    </tr>
-                </thead>
-                <tbody>
-                    {% for service, count in service_counts.items() %}
-                    <tr>
-                        <td>{{ service }}</td>
-                        <td>{{ count }}</td>
-                    </tr>
-                    {% endfor %}
-                </tbody>
-            </table>
-        </div>
-    </div>
-
-    <!-- 在這裡插入 footer，以便在主要內容之後顯示開發者資訊 -->
-<footer class="bg-dark text-white py-4">
-    <div class="container">
-        <div class="d-flex flex-column flex-md-row justify-content-center align-items-center">
-            <div class="d-flex align-items-center mb-3 mb-md-0 me-md-4">
-                <i class="bi bi-person-fill me-2"></i>
-                <span>Developer：Austin Huang</span>
-            </div>
-            <div class="d-flex align-items-center mb-3 mb-md-0 me-md-4">
-                <a href="https://github.com/austinhuangdev" target="_blank" rel="noopener noreferrer" class="text-white text-decoration-none d-flex align-items-center">
-                    <i class="bi bi-github me-2"></i>
-                    <span>GitHub</span>
-                </a>
-            </div>
-            <div class="d-flex align-items-center">
-                <a href="mailto:austinhuangdev@gmail.com" class="text-white text-decoration-none d-flex align-items-center">
-                    <i class="bi bi-envelope-fill me-2"></i>
-                    <span>austinhuangdev@gmail.com</span>
-                </a>
-            </div>
-        </div>
-        <div class="text-center mt-3">
-            <small>&copy; 2024 Austin Huang. All rights reserved.</small>
-        </div>
-    </div>
-</footer>
-
+        most_common_service = service_counts.most_common(1)[0][0] if service_counts else "無"
+        # 圓餅圖只保留前 CHART_TOP_N 名服務，其餘合併為「其他」，避免切片與圖例無限增長
+        top_services = service_counts.most_common(CHART_TOP_N)
+        chart_labels = [name for name, _ in top_services]
+        chart_data = [count for _, count in top_services]
+        other_count = total_open_ports - sum(chart_data)
+        if other_count:
+            chart_labels.append("其他")
+            chart_data.append(other_count)
+
+        template = report_template()
+
+        # 序列化資料為 JSON（在 Python 端一次完成，模板直接輸出）
+        json_chart_labels = script_json(chart_labels)
+        json_chart_data = script_json(chart_data)
+
+        # 排序並預先決定每個徽章的文字、顏色與圖示
+        rows = build_report_rows(host_info, order)
+        # 列數不多時搜尋與分頁幫助不大，直接輸出靜態表格省下 Simple-DataTables 的載入與初始化
+        host_datatable = len(rows) > STATIC_TABLE_LIMIT
+        if host_datatable:
+            # 整理成精簡的陣列，以 JSON 交由前端分頁產生表格
+            host_rows = [
+                [
+                    row["ip"],
+                    row["mac_address"],
+                    [[b["label"], b["title"], b["color"], b["icon"]] for b in row["badges"]],
+                ]
+                for row in rows
+            ]
+        else:
+            # 靜態表格的徽章 HTML 直接在 Python 端產生，模板只需輸出
+            host_rows = [[row["ip"], row["mac_address"], render_badges(row["badges"])] for row in rows]
 
-    
-    <!-- Bootstrap JS Bundle with Popper -->
-    <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js"></script>
-    <!-- Simple-DataTables JS -->
-    <script src="https://cdn.jsdelivr.net/npm/simple-datatables@latest"></script>
-    <!-- Chart.js -->
-    <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-    <script>
-        document.addEventListener('DOMContentLoaded', () => {
-            // 初始化 Simple-DataTables
-            const hostTable = document.querySelector('#hostTable');
-            if (hostTable) {
-                new simpleDatatables.DataTable(hostTable, {
-                    searchable: true,
-                    fixedHeight: false,
-                    perPage: 10,
-                    perPageSelect: [10, 25, 50, '全部'],
-                    labels: {
-                        placeholder: "搜尋...",
-                        perPage: "每頁顯示",
-                        noRows: "無資料",
-                        info: "顯示 {start} 至 {end} 筆，共 {rows} 筆",
-                        all: "全部"
-                    }
-                });
-            }
-            
-            const serviceTable = document.querySelector('#serviceTable');
-            if (serviceTable) {
-                new simpleDatatables.DataTable(serviceTable, {
-                    searchable: true,
-                    fixedHeight: false,
-                    perPage: 10,
-                    perPageSelect: [10, 25, 50, '全部'],
-                    labels: {
-                        placeholder: "搜尋...",
-                        perPage: "每頁顯示",
-                        noRows: "無資料",
-                        info: "顯示 {start} 至 {end} 筆，共 {rows} 筆",
-                        all: "全部"
-                    }
-                });
-            }
-
-            // 初始化 Chart.js (圓餅圖)
-            const ctx = document.getElementById('servicePieChart').getContext('2d');
-            const servicePieChart = new Chart(ctx, {
-                type: 'pie',
-                data: {
-                    labels: {{ json_chart_labels|tojson }},
-                    datasets: [{
-                        label: '服務分佈',
-                        data: {{ json_chart_data|tojson }},
-                        backgroundColor: [
-                            'rgba(54, 162, 235, 0.7)',
-                            'rgba(255, 99, 132, 0.7)',
-                            'rgba(255, 206, 86, 0.7)',
-                            'rgba(75, 192, 192, 0.7)',
-                            'rgba(153, 102, 255, 0.7)',
-                            'rgba(255, 159, 64, 0.7)',
-                            'rgba(199, 199, 199, 0.7)',
-                            'rgba(83, 102, 255, 0.7)',
-                            'rgba(255, 99, 132, 0.7)',
-                            'rgba(54, 162, 235, 0.7)',
-                            'rgba(255, 206, 86, 0.7)',
-                            'rgba(75, 192, 192, 0.7)'
-                        ],
-                        borderColor: [
-                            'rgba(54, 162, 235, 1)',
-                            'rgba(255, 99, 132, 1)',
-                            'rgba(255, 206, 86, 1)',
-                            'rgba(75, 192, 192, 1)',
-                            'rgba(153, 102, 255, 1)',
-                            'rgba(255, 159, 64, 1)',
-                            'rgba(199, 199, 199, 1)',
-                            'rgba(83, 102, 255, 1)',
-                            'rgba(255, 99, 132, 1)',
-                            'rgba(54, 162, 235, 1)',
-                            'rgba(255, 206, 86, 1)',
-                            'rgba(75, 192, 192, 1)'
-                        ],
-                        borderWidth: 1
-                    }]
-                },
-                options: {
-                    responsive: true,
-                    plugins: {
-                        legend: {
-                            position: 'top',
-                        },
-                        tooltip: {
-                            callbacks: {
-                                label: function(context) {
-                                    const label = context.label || '';
-                                    const value = context.parsed || 0;
-                                    const total = context.chart._metasets[context.datasetIndex].total;
-                                    const percentage = ((value / total) * 100).toFixed(2) + '%';
-                                    return label + ': ' + value + ' (' + percentage + ')';
-                                }
-                            }
-                        }
-                    }
-                },
-            });
-
-            // 初始化 Bootstrap Tooltips
-            const tooltipTriggerList = Array.from(document.querySelectorAll('[data-bs-toggle="tooltip"]'));
-            const tooltipList = tooltipTriggerList.map(tooltipTriggerEl => new bootstrap.Tooltip(tooltipTriggerEl));
-        });
-    </script>
-</body>
-</html>
-        """)
-
-        # 序列化資料為 JSON
-        json_chart_labels = chart_labels
-        json_chart_data = chart_data
-
-        # 排序後再轉成列表
-        sorted_host_info = sorted(host_info.items(), key=lambda x: socket.inet_aton(x[0]))
-
-        html_content = template.render(
+        # 以串流方式邊渲染邊寫入，避免整份報告先組成一個大字串
+        stream = template.stream(
             scan_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
             target=target,
             active_hosts_count=len(host_info),
             total_open_ports=total_open_ports,
             service_types=service_types,
             most_common_service=most_common_service,
-            sorted_host_info=sorted_host_info,
+            host_rows=host_rows,
+            json_host_rows=script_json(host_rows) if host_datatable else None,
+            host_datatable=host_datatable,
+            service_datatable=len(service_counts) > STATIC_TABLE_LIMIT,
             service_counts=service_counts,
             json_chart_labels=json_chart_labels,
             json_chart_data=json_chart_data,
-            service_styles=service_styles
         )
+        stream.enable_buffering(size=50)
 
         with open(filename, 'w', encoding='utf-8') as f:
-            f.write(html_content)
+            stream.dump(f)
         console.print(f"[bold green]成功輸出掃描報告至 [underline]{filename}[/underline][/bold green]")
     except Exception as e:
-        logging.error(f"輸出 HTML 報告失敗：{e}")
+        logging.error("輸出 HTML 報告失敗：%s", e)
         console.print(f"[bold red]輸出 HTML 報告失敗：{e}[/bold red]")
 
 #----------------------------------------------------------------------
-#  15. Ping 掃描 (第一階段)
+#  15. 探測活躍機器 (第一階段)
 #----------------------------------------------------------------------
-def ping_scan(hosts):
-    """Ping 探測活躍機器"""
-    active_hosts = []
-    console.print("[bold blue]🔍 第一階段：Ping 探測活躍機器[/bold blue]")
-    with Progress(
+def scan_progress():
+    """建立各階段共用的進度條（限制重繪頻率，避免大量更新拖慢掃描）"""
+    return Progress(
         SpinnerColumn(),
         TextColumn("[progress.description]{task.description}"),
         BarColumn(),
@@ -1003,91 +1136,252 @@ def ping_scan(hosts):
         TimeElapsedColumn(),
         TimeRemainingColumn(),
         console=console,
-    ) as progress:
-        task = progress.add_task("[cyan]正在 Ping 探測...", total=len(hosts))
-        with ThreadPoolExecutor(max_workers=100) as executor:
-            futures = {executor.submit(ping_ip, str(ip)): ip for ip in hosts}
-            for future in as_completed(futures):
-                ip = futures[future]
-                try:
-                    result = future.result()
-                    if result:
-                        active_hosts.append(str(ip))
-                except Exception as e:
-                    logging.error(f"Ping {ip} 時出錯: {e}")
-                progress.update(task, advance=1, description=f"[cyan]正在 Ping 探測 IP：{ip}[/cyan]")
-    return sorted(active_hosts, key=lambda x: socket.inet_aton(x))
+        refresh_per_second=PROGRESS_REFRESH_RATE,
+    )
+
+class ProgressBatcher:
+    """累積完成數，每 batch 筆才更新一次進度條，描述文字也只在更新時才格式化"""
+
+    def __init__(self, progress, task, description, batch=PROGRESS_BATCH):
+        self.progress = progress
+        self.task = task
+        self.description = description
+        self.batch = batch
+        self.pending = 0
+
+    def advance(self, *args):
+        self.pending += 1
+        if self.pending >= self.batch:
+            self.progress.update(self.task, advance=self.pending, description=self.description.format(*args))
+            self.pending = 0
+
+    def flush(self):
+        """補上尚未更新的完成數"""
+        if self.pending:
+            self.progress.update(self.task, advance=self.pending)
+            self.pending = 0
+
+def ping_scan(hosts, use_ping=False, arp_ttl=ARP_CACHE_TTL):
+    """探測活躍機器（預設為非同步 TCP 探測，use_ping=True 時改用 fping / ARP 廣播 / 系統 ping）"""
+    active_hosts = []
+    console.print("[bold blue]🔍 第一階段：探測活躍機器[/bold blue]")
+    with scan_progress() as progress:
+        task = progress.add_task("[cyan]正在探測...", total=len(hosts))
+
+        batcher = ProgressBatcher(progress, task, "[cyan]正在探測 IP：{}[/cyan]")
+        on_result = batcher.advance
+
+        if not use_ping:
+            active_hosts = asyncio.run(discover(hosts, on_result=on_result))
+        else:
+            active_hosts = batch_ping(hosts, arp_ttl)
+            if active_hosts is not None:
+                progress.update(task, completed=len(hosts), description="[cyan]批次探測完成[/cyan]")
+            else:
+                # 無法批次探測時，才逐一呼叫系統 ping
+                active_hosts = []
+                with ThreadPoolExecutor(max_workers=100) as executor:
+                    futures = {executor.submit(ping_ip, str(ip)): ip for ip in hosts}
+                    for future in as_completed(futures):
+                        ip = futures[future]
+                        try:
+                            result = future.result()
+                            if result:
+                                active_hosts.append(str(ip))
+                        except Exception as e:
+                            logging.error("Ping %s 時出錯: %s", ip, e)
+                        on_result(ip)
+        batcher.flush()
+    return sorted(active_hosts, key=ip_sort_key)
 
 #----------------------------------------------------------------------
 #  16. 取得 MAC
 #----------------------------------------------------------------------
-def retrieve_host_info(active_hosts):
+def retrieve_host_info(active_hosts, arp_ttl=ARP_CACHE_TTL):
     """取得 MAC 位址"""
     console.print("[bold blue]🔍 第二階段：取得 MAC 位址[/bold blue]")
-    host_info = {}
-    with Progress(
-        SpinnerColumn(),
-        TextColumn("[progress.description]{task.description}"),
-        BarColumn(),
-        TextColumn("[{task.completed}/{task.total}]"),
-        TimeElapsedColumn(),
-        TimeRemainingColumn(),
-        console=console,
-    ) as progress:
-        task = progress.add_task("[cyan]正在取得 MAC 位址...", total=len(active_hosts))
-        with ThreadPoolExecutor(max_workers=50) as executor:
-            mac_futures = {executor.submit(get_mac_address, ip): ip for ip in active_hosts}
-
-            for future in as_completed(mac_futures):
-                ip = mac_futures[future]
-                try:
-                    mac = future.result()
-                except Exception as e:
-                    logging.error(f"取得 {ip} 的 MAC 位址時出錯: {e}")
-                    mac = "錯誤"
-                host_info[ip] = {"mac_address": mac}
-                progress.update(task, advance=1, description=f"[cyan]正在取得 MAC 位址：{ip}[/cyan]")
-    return host_info
+    refresh_arp_table(arp_ttl)
+    return {ip: {"mac_address": get_mac_address(ip)} for ip in active_hosts}
 
 #----------------------------------------------------------------------
 #  17. 埠掃描 (第三階段)
 #----------------------------------------------------------------------
-def port_scan(active_hosts, port_list):
+def socket_budget():
+    """同時可開啟的探測 socket 上限：RLIMIT_NOFILE 扣除 FD_RESERVE；無法取得或不設限時回傳 None"""
+    if resource is None:
+        return None
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return None
+    return max(soft - FD_RESERVE, 2)
+
+async def scan_ports(active_hosts, port_list, concurrency=PORT_SCAN_CONCURRENCY,
+                     per_host_concurrency=PER_HOST_CONCURRENCY, on_result=None):
+    """以單一事件迴圈掃描所有 (IP, 埠) 組合，回傳每台主機的開放埠"""
+    # 連線數超過檔案描述元上限會得到 EMFILE，被誤判為埠未開放
+    budget = socket_budget()
+    if budget is not None:
+        concurrency = min(concurrency, budget)
+    sem = asyncio.Semaphore(concurrency)
+    # 每台主機另有連線上限，避免單一目標同時收到過多 SYN 而丟包
+    results = await asyncio.gather(*(
+        scan_host_ports(ip, port_list, sem, asyncio.Semaphore(per_host_concurrency), on_result)
+        for ip in active_hosts
+    ))
+    return {ip: {"open_ports": open_ports} for ip, open_ports in zip(active_hosts, results)}
+
+def scan_ports_sync(active_hosts, port_list, batch_size=SYNC_BATCH_SIZE, on_result=None):
+    """--sync 模式：以 batch_connect 分批探測埠，只對開放的埠沿用連線偵測服務"""
+    # 每批的 socket 在偵測服務時仍全部開著，批次大小不可超過檔案描述元上限
+    # （socket_budget 已扣除 FD_RESERVE，保留事件迴圈自身需要的描述元）
+    budget = socket_budget()
+    if budget is not None:
+        batch_size = min(batch_size, budget)
+    host_ports = {ip: {"open_ports": []} for ip in active_hosts}
+    targets = list(product(active_hosts, port_list))
+    for start in range(0, len(targets), batch_size):
+        batch = targets[start:start + batch_size]
+        connected = batch_connect(batch)
+        if connected:
+            for ip, result in asyncio.run(detect_connected(connected)):
+                host_ports[ip]["open_ports"].append(result)
+        if on_result:
+            for ip, port in batch:
+                on_result(ip, port)
+    return host_ports
+
+def port_scan(active_hosts, port_list, per_host_concurrency=PER_HOST_CONCURRENCY, sync=False):
     """掃描開放埠並偵測服務"""
     console.print("\n[bold blue]🔍 第三階段：掃描開放的埠並偵測服務[/bold blue]")
-    host_ports = {ip: {"open_ports": []} for ip in active_hosts}
+    # 埠清單只在這裡去重並排序一次（仍存為 uint16 陣列），重複指定的埠不會被重複掃描
+    port_list = array.array('H', sorted(set(port_list)))
     total_tasks = len(active_hosts) * len(port_list)
-    with Progress(
-        SpinnerColumn(),
-        TextColumn("[progress.description]{task.description}"),
-        BarColumn(),
-        TextColumn("[{task.completed}/{task.total}]"),
-        TimeElapsedColumn(),
-        TimeRemainingColumn(),
-        console=console,
-    ) as progress:
+    with scan_progress() as progress:
         task = progress.add_task("[cyan]正在掃描埠...", total=total_tasks)
-        with ThreadPoolExecutor(max_workers=100) as executor:
-            futures = {}
-            for ip in active_hosts:
-                for port in sorted(port_list):
-                    futures[executor.submit(scan_port, ip, port)] = (ip, port)
-            for future in as_completed(futures):
-                ip, port = futures[future]
-                try:
-                    result = future.result()
-                    if result:
-                        port_num, service, version = result
-                        host_ports[ip]["open_ports"].append((port_num, service, version))
-                except Exception as e:
-                    logging.error(f"掃描 {ip}:{port} 時出錯: {e}")
-                progress.update(task, advance=1, description=f"[cyan]正在掃描 IP：{ip} 埠：{port}[/cyan]")
+
+        batcher = ProgressBatcher(progress, task, "[cyan]正在掃描 IP：{} 埠：{}[/cyan]")
+        on_result = batcher.advance
+
+        if sync:
+            host_ports = scan_ports_sync(active_hosts, port_list, on_result=on_result)
+        else:
+            host_ports = asyncio.run(
+                scan_ports(active_hosts, port_list, per_host_concurrency=per_host_concurrency, on_result=on_result)
+            )
+        batcher.flush()
+    # 結果依完成順序收集，這裡統一依埠號排序一次，之後的報告輸出不必再各自排序
+    for info in host_ports.values():
+        info["open_ports"].sort(key=lambda x: x[0])
     return host_ports
 
+async def scan_pipeline(hosts, port_list, per_host_concurrency=PER_HOST_CONCURRENCY,
+                        arp_ttl=ARP_CACHE_TTL, on_probe=None, on_alive=None, on_mac=None, on_port=None):
+    """
+    - 將探測、取得 MAC、埠掃描串成同一個事件迴圈內的管線。
+    - 主機一確認存活，就立即排入該主機的 MAC 查詢與埠掃描，不必等所有主機探測完畢。
+    - 回傳 {ip: {"mac_address": ..., "open_ports": [...]}}，只包含活躍主機。
+    """
+    # 探測與埠掃描同時進行，兩者的連線數合計不可超過檔案描述元上限，
+    # 否則 EMFILE 會被誤判為主機未存活或埠未開放；超過時依原本的比例分配
+    probe_limit, scan_limit = DISCOVERY_CONCURRENCY, PORT_SCAN_CONCURRENCY
+    budget = socket_budget()
+    if budget is not None and probe_limit + scan_limit > budget:
+        probe_limit = max(1, budget * probe_limit // (probe_limit + scan_limit))
+        scan_limit = max(1, budget - probe_limit)
+    probe_sem = asyncio.Semaphore(probe_limit)
+    scan_sem = asyncio.Semaphore(scan_limit)
+    loop = asyncio.get_running_loop()
+    host_info = {}
+    refreshing = None
+    refreshed_at = 0.0
+
+    async def lookup_mac(ip):
+        nonlocal refreshing, refreshed_at
+        if get_mac_address(ip) == "未知":
+            # 讀取 ARP 表可能需要啟動 arp 子行程，交給執行緒進行；同時只保留一次讀取，
+            # 且兩次讀取至少間隔 ARP_REFRESH_INTERVAL（不在同網段的主機永遠查不到，不能每台都重讀）；
+            # 這段期間查不到的主機由 main 掃描結束後的最後一次讀取補齊
+            if refreshing is None or (refreshing.done() and loop.time() - refreshed_at >= ARP_REFRESH_INTERVAL):
+                refreshed_at = loop.time()
+                refreshing = loop.run_in_executor(None, refresh_arp_table, arp_ttl)
+            await refreshing
+        host_info[ip]["mac_address"] = get_mac_address(ip)
+        if on_mac:
+            on_mac(ip)
+
+    async def handle_host(ip):
+        _, alive = await probe_host(ip, probe_sem)
+        if on_probe:
+            on_probe(ip)
+        if not alive:
+            return
+        host_info[ip] = {"mac_address": "未知", "open_ports": []}
+        if on_alive:
+            on_alive(ip)
+        host_sem = asyncio.Semaphore(per_host_concurrency)
+        _, open_ports = await asyncio.gather(
+            lookup_mac(ip), scan_host_ports(ip, port_list, scan_sem, host_sem, on_port)
+        )
+        host_info[ip]["open_ports"] = open_ports
+
+    await asyncio.gather(*(handle_host(str(ip)) for ip in hosts))
+    return host_info
+
+def pipeline_scan(hosts, port_list, per_host_concurrency=PER_HOST_CONCURRENCY, arp_ttl=ARP_CACHE_TTL):
+    """探測、取得 MAC 與埠掃描同時進行，三個進度條一起顯示；回傳 (依 IP 排序的活躍主機, host_info)"""
+    console.print("[bold blue]🔍 探測活躍機器、取得 MAC 位址並掃描開放的埠[/bold blue]")
+    # 埠清單只在這裡去重並排序一次（仍存為 uint16 陣列），重複指定的埠不會被重複掃描
+    port_list = array.array('H', sorted(set(port_list)))
+    with scan_progress() as progress:
+        probe_task = progress.add_task("[cyan]正在探測...", total=len(hosts))
+        mac_task = progress.add_task("[cyan]取得 MAC 位址...", total=0)
+        port_task = progress.add_task("[cyan]正在掃描埠...", total=0)
+        probe_batcher = ProgressBatcher(progress, probe_task, "[cyan]正在探測 IP：{}[/cyan]")
+        port_batcher = ProgressBatcher(progress, port_task, "[cyan]正在掃描 IP：{} 埠：{}[/cyan]")
+        alive_count = 0
+
+        def on_alive(ip):
+            # 每發現一台活躍主機，MAC 與埠掃描的總數隨之增加
+            nonlocal alive_count
+            alive_count += 1
+            progress.update(mac_task, total=alive_count)
+            progress.update(port_task, total=alive_count * len(port_list))
+
+        def on_mac(ip):
+            progress.update(mac_task, advance=1)
+
+        host_info = asyncio.run(scan_pipeline(
+            hosts, port_list, per_host_concurrency=per_host_concurrency, arp_ttl=arp_ttl,
+            on_probe=probe_batcher.advance, on_alive=on_alive, on_mac=on_mac, on_port=port_batcher.advance,
+        ))
+        probe_batcher.flush()
+        port_batcher.flush()
+    # 結果依完成順序收集，這裡統一依埠號排序一次，之後的報告輸出不必再各自排序
+    for info in host_info.values():
+        info["open_ports"].sort(key=lambda x: x[0])
+    return sorted(host_info, key=ip_sort_key), host_info
+
+def staged_scan(hosts, port_list, use_ping=False, per_host_concurrency=PER_HOST_CONCURRENCY,
+                sync=False, arp_ttl=ARP_CACHE_TTL):
+    """
+    - 依序執行探測、取得 MAC、埠掃描三個階段（--ping 需先取得完整活躍清單，--sync 不使用事件迴圈掃描）。
+    - 回傳 (依 IP 排序的活躍主機, host_info)。
+    """
+    active_hosts = ping_scan(hosts, use_ping=use_ping, arp_ttl=arp_ttl)
+    if not active_hosts:
+        return [], {}
+    console.print(f"[bold green]✅ 發現 {len(active_hosts)} 台活躍的機器。[/bold green]\n")
+
+    host_info = retrieve_host_info(active_hosts, arp_ttl=arp_ttl)
+    host_ports = port_scan(active_hosts, port_list, per_host_concurrency=per_host_concurrency, sync=sync)
+    for ip, ports in host_ports.items():
+        host_info[ip]["open_ports"] = ports["open_ports"]
+    return active_hosts, host_info
+
 #----------------------------------------------------------------------
 #  18. 終端輸出報告 (Rich)
 #----------------------------------------------------------------------
-def generate_report(host_info):
+def generate_report(host_info, order=None):
     """生成並顯示最終報告"""
     console.print("\n[bold green]✨ 掃描完成！生成最終報告：[/bold green]\n")
     try:
@@ -1096,25 +1390,15 @@ def generate_report(host_info):
         result_table.add_column("MAC 位址", style="yellow")
         result_table.add_column("開放的埠及服務", style="green")
 
-        for ip in sorted(host_info.keys(), key=lambda x: socket.inet_aton(x)):
+        for ip in host_order(host_info, order):
             info = host_info[ip]
-            port_service_list = []
-            for port, service, version in sorted(info.get("open_ports", []), key=lambda x: x[0]):
-                service_str = f"{port}"
-                if service:
-                    service_str += f" ({service})"
-                if version:
-                    # 限制版本資訊的長度
-                    version = (version[:30] + '...') if len(version) > 30 else version
-                    service_str += f" [{version}]"
-                port_service_list.append(service_str)
-            open_ports_services = ", ".join(port_service_list) if port_service_list else "無"
+            open_ports_services = format_open_ports(info.get("open_ports", ()))
             mac_address = info.get("mac_address", "未知")
             result_table.add_row(ip, mac_address, open_ports_services)
 
         console.print(result_table)
     except Exception as e:
-        logging.error(f"生成報告時出錯：{e}")
+        logging.error("生成報告時出錯：%s", e)
         console.print(f"[bold red]生成報告時出錯：{e}[/bold red]")
 
 #----------------------------------------------------------------------
@@ -1161,6 +1445,10 @@ def main():
     
     start_time = time.time()
     args = parse_arguments()
+
+    # 若已安裝 uvloop，改用其事件迴圈實作
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
     target = args.target
     port_list = args.ports
 
@@ -1202,36 +1490,37 @@ def main():
     # 取得所有主機清單 (若是單一 IP，就只有一個)
     all_hosts = list(ip_net.hosts())
     
-    # 第一階段：Ping 探測
-    active_hosts = ping_scan(all_hosts)
+    if args.ping or args.sync:
+        active_hosts, host_info = staged_scan(
+            all_hosts, port_list, use_ping=args.ping, per_host_concurrency=args.per_host_concurrency,
+            sync=args.sync, arp_ttl=args.arp_ttl,
+        )
+    else:
+        # 預設：探測、取得 MAC 與埠掃描以管線方式同時進行
+        active_hosts, host_info = pipeline_scan(
+            all_hosts, port_list, per_host_concurrency=args.per_host_concurrency, arp_ttl=args.arp_ttl
+        )
+        if host_info:
+            console.print(f"[bold green]✅ 發現 {len(host_info)} 台活躍的機器。[/bold green]\n")
 
-    if not active_hosts:
+    if not host_info:
         console.print("[yellow]未發現任何活躍的機器。[/yellow]")
         logging.info("未發現任何活躍機器，程式結束。")
         sys.exit(0)
 
-    console.print(f"[bold green]✅ 發現 {len(active_hosts)} 台活躍的機器。[/bold green]\n")
-
-    # 第二階段：取得 MAC 位址
-    host_info = retrieve_host_info(active_hosts)
-
-    # 第三階段：埠掃描 + 服務偵測
-    host_ports = port_scan(active_hosts, port_list)
-
-    # 整合 host_info 與 host_ports
-    for ip in host_ports:
-        if ip in host_info:
-            host_info[ip]["open_ports"] = host_ports[ip]["open_ports"]
-        else:
-            host_info[ip] = {"mac_address": "未知", "open_ports": host_ports[ip]["open_ports"]}
+    # 埠掃描期間可能產生新的 ARP 紀錄，再讀取一次以補齊未知的 MAC 位址
+    refresh_arp_table(args.arp_ttl)
+    for ip, info in host_info.items():
+        if info["mac_address"] == "未知":
+            info["mac_address"] = get_mac_address(ip)
 
     # 終端輸出最終報告
-    generate_report(host_info)
+    generate_report(host_info, order=active_hosts)
 
     # 匯出 CSV
-    export_to_csv(host_info, filename=csv_path)
+    export_to_csv(host_info, filename=csv_path, order=active_hosts)
     # 匯出 HTML
-    export_to_html(host_info, filename=html_path, target=target)
+    export_to_html(host_info, filename=html_path, target=target, order=active_hosts)
 
     # 輸出成功訊息（包含 LOG 檔）
     console.print(f"[bold green]成功輸出 Log 檔案至 [underline]{log_path}[/underline][/bold green]")